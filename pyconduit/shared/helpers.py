@@ -1,6 +1,7 @@
 import os
+import re
 from functools import lru_cache
-from typing import Callable, Sequence, TypeVar
+from typing import Callable, Iterable, Sequence, TypeVar
 
 import yaml
 
@@ -44,3 +45,24 @@ def partition(objects: Sequence[T], count: int, predicate: Callable[[T], int]) -
 
 def transform_to_login(username: str) -> str:
     return "".join([login_transtable.get(x, x) for x in username.lower()])
+
+
+# compiles literal strings into a trie-shaped regex, which always prefers the longest match
+def literal_regex(words: Iterable[str]) -> re.Pattern:
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in node.items() if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if "" in node:
+            pattern = f"(?:{pattern})?"
+        return pattern
+
+    return re.compile(build(trie))
@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 from markdown_it import MarkdownIt
 from mdit_py_plugins.anchors import anchors_plugin
@@ -6,7 +7,7 @@ from TexSoup import TexNode
 from TexSoup.utils import Token
 
 from pyconduit.models.latex import LatexDocument, LatexObject, LatexText
-from pyconduit.shared.helpers import get_config
+from pyconduit.shared.helpers import get_config, literal_regex
 from pyconduit.shared.latex.core import (
     CaptionMacro,
     ErrorCommand,
@@ -48,8 +49,10 @@ Replacements = {
     "--": "–",
     "\\\\": "\n\n",
     "\\ ": " ",
-    "~": " ",
 }
+# A trie-shaped pattern scans the text once without backtracking across alternatives,
+# and still matches "----" before "---" and "--"
+replacement_regex = literal_regex(Replacements)
 
 text_regex = re.compile(r"\\text\{(.+?)}")
 comment_regex = re.compile(r"(^|[^\\])%.*?\n", re.M)
@@ -138,10 +141,55 @@ def collect_excess(doc: LatexDocument, current_metadata: MetadataNode) -> None:
         raise ValueError(locale["exceptions"]["stacking_limit"])
 
 
+def collect_text(doc: LatexDocument, current_metadata: MetadataNode, text: str) -> MetadataNode:
+    new_node, excess_text = current_metadata.collect(text)
+    if new_node:
+        # excess_text is guaranteed None because the current mode does not collect text
+        doc.objects.append(LatexObject.parse_obj(new_node))
+        return MetadataNode("text")
+    return current_metadata
+
+
+def handle_text(doc: LatexDocument, current_metadata: MetadataNode, node: str) -> MetadataNode:
+    return collect_text(doc, current_metadata, text_regex.sub("\\1", str(node)))
+
+
+def handle_tex_node(doc: LatexDocument, current_metadata: MetadataNode, node: TexNode) -> MetadataNode:
+    # math goes through the same path as text, only without unwrapping \text{}
+    if node.name.startswith("$"):
+        return collect_text(doc, current_metadata, str(node))
+    if node.contents == [""]:
+        return current_metadata
+    raise ValueError(locale["exceptions"]["unknown_node"] % dict(node=node, type=type(node)))
+
+
+def handle_metadata(doc: LatexDocument, current_metadata: MetadataNode, node: MetadataNode) -> MetadataNode:
+    collect_excess(doc, current_metadata)
+    return node
+
+
+# Top-level nodes are dispatched by their exact type, subclasses fall back to isinstance checks
+NodeHandlers = {
+    str: handle_text,
+    Token: handle_text,
+    TexNode: handle_tex_node,
+    MetadataNode: handle_metadata,
+}
+
+
+def handle_other(doc: LatexDocument, current_metadata: MetadataNode, node) -> MetadataNode:
+    if node is None:
+        return current_metadata
+    for node_type, handler in NodeHandlers.items():
+        if isinstance(node, node_type):
+            return handler(doc, current_metadata, node)
+    raise ValueError(locale["exceptions"]["unknown_node"] % dict(node=node, type=type(node)))
+
+
 def build_latex(latext: str) -> LatexDocument:
     doc = LatexDocument(objects=[], orig_doc=latext)
-    for value, replacement in Replacements.items():
-        latext = latext.replace(value, replacement)
+    # ~ is swapped after the regex pass, so that "\~" does not turn into "\ " and then into a space
+    latext = replacement_regex.sub(lambda t: Replacements[t[0]], latext).replace("~", " ")
 
     latext = comment_regex.sub("\\1", latext)
     soup, context = convert_latex(dict(BuiltinCommands), latext)
@@ -159,23 +207,7 @@ def build_latex(latext: str) -> LatexDocument:
 
     current_metadata = MetadataNode("text")
     for node in soup.contents:
-        is_math = isinstance(node, TexNode) and node.name and node.name[0] == "$"
-        if isinstance(node, str) or isinstance(node, Token) or is_math:
-            node = str(node)
-            if not is_math:
-                node = text_regex.sub("\\1", node)
-            new_node, excess_text = current_metadata.collect(node)
-            if new_node:
-                # excess_text is guaranteed None because the current mode does not collect text
-                doc.objects.append(LatexObject.parse_obj(new_node))
-                current_metadata = MetadataNode("text")
-        elif isinstance(node, MetadataNode):
-            collect_excess(doc, current_metadata)
-            current_metadata = node
-        elif (isinstance(node, TexNode) and node.contents == [""]) or node is None:
-            pass
-        else:
-            raise ValueError(locale["exceptions"]["unknown_node"] % dict(node=node, type=type(node)))
+        current_metadata = NodeHandlers.get(type(node), handle_other)(doc, current_metadata, node)
 
     collect_excess(doc, current_metadata)
 
@@ -197,6 +229,12 @@ def build_latex(latext: str) -> LatexDocument:
     return doc
 
 
+@lru_cache(maxsize=256)
+def render_markdown(md: str) -> str:
+    # sheets are mostly viewed unchanged, and rendering is a pure function of the markdown
+    return md_generator.render(md)
+
+
 def generate_html(doc: LatexDocument) -> str:
     md = doc.generate_markdown().replace("-> ###", "### ->").replace("\\{", "\\\\{").replace("\\}", "\\\\}")
-    return md_generator.render(md)
+    return render_markdown(md)
@@ -1,9 +1,11 @@
 import abc
-import random
+import copy
 import re
+from bisect import bisect_left
+from functools import lru_cache
 
 from TexSoup import TexNode, TexSoup
-from TexSoup.data import TexCmd, TexText
+from TexSoup.data import TexCmd, TexExpr, TexText
 
 from pyconduit.shared.datastore import datastore_manager
 from pyconduit.shared.helpers import get_config
@@ -12,7 +14,8 @@ cfg = get_config("latex")
 locale = get_config("localization")
 first_problem_character = cfg["iterators"]["first-letter"]
 problem_skips = cfg["iterators"]["letter-skips"]
-problem_skip_indices = [ord(c) - ord(first_problem_character) - 1 for c in problem_skips]
+# sorted, so that the number of skipped letters before any index is a binary search away
+problem_skip_indices = tuple(sorted(ord(c) - ord(first_problem_character) - 1 for c in problem_skips))
 priority_cap = 10000
 image_datastore = datastore_manager.get("images")
 
@@ -22,37 +25,75 @@ class MetadataNode:
         self.collect_text = collect_text
         self.kwargs = kwargs
         kwargs["cls"] = cls
+        # collected text is kept as a list of non-empty chunks and only joined when the node is emitted
+        self.chunks = [kwargs["text"]] if collect_text and kwargs.get("text") else []
+
+    def rstrip(self) -> None:
+        while self.chunks and self.chunks[-1].isspace():
+            self.chunks.pop()
+        if self.chunks:
+            self.chunks[-1] = self.chunks[-1].rstrip()
 
     def collect(self, text: str | None) -> tuple[None | dict, str]:
-        if self.collect_text and "text" not in self.kwargs:
-            self.kwargs["text"] = ""
+        if not self.collect_text:
+            return self.kwargs, ""
 
-        if self.collect_text and text is not None:
+        if text is not None:
             text = text.lstrip(" ")
-            if text and self.kwargs["text"]:
+            if text and self.chunks:
+                last = self.chunks[-1][-1]
                 if (
-                    (text[0] in "$" and self.kwargs["text"][-1] not in ".?!(*")
-                    or (self.kwargs["text"][-1] in "$>*" and text[0] not in "$,.-?!:)")
-                    or (text[0] in "*" and self.kwargs["text"][-1] not in "$")
+                    (text[0] in "$" and last not in ".?!(*")
+                    or (last in "$>*" and text[0] not in "$,.-?!:)")
+                    or (text[0] in "*" and last not in "$")
                 ):
-                    self.kwargs["text"] = self.kwargs["text"].rstrip() + " "
-            self.kwargs["text"] += text.replace("\n\n", "<br />").strip()
-        elif not self.collect_text or self.kwargs["text"].strip():
-            excess_text = ""
-            if self.collect_text:
-                # self.kwargs["text"] = self.kwargs["text"].strip()
-                if "\n\n" in self.kwargs["text"]:
-                    self.kwargs["text"], excess_text = self.kwargs["text"].split("\n\n", 1)
-                    self.kwargs["text"] = self.kwargs["text"].rstrip()
-                    # excess_text = excess_text.strip("\n\r\t")
-            return self.kwargs, excess_text
+                    self.rstrip()
+                    self.chunks.append(" ")
+            if text := text.replace("\n\n", "<br />").strip():
+                self.chunks.append(text)
+            return None, ""
+
+        collected = "".join(self.chunks)
+        self.chunks = [collected] if collected else []
+        if not collected.strip():
+            return None, ""
 
-        return None, ""
+        excess_text = ""
+        if "\n\n" in collected:
+            collected, excess_text = collected.split("\n\n", 1)
+            collected = collected.rstrip()
+        self.kwargs["text"] = collected
+        return self.kwargs, excess_text
 
 
 apply_result = str | TexNode | MetadataNode
 
 
+@lru_cache(maxsize=cfg["compilation"]["parse-cache-size"])
+def parse_cached(latext: str) -> TexNode:
+    return TexSoup(latext)
+
+
+# reuses earlier parses of the same text, the returned copy is safe to modify
+def parse_latex(latext: str) -> TexNode:
+    # copying the expression tree is roughly ten times cheaper than parsing it again
+    return TexNode(copy.deepcopy(parse_cached(latext).expr))
+
+
+# names of the given expressions and of everything nested inside them
+def expression_names(*nodes) -> set[str]:
+    names = set()
+    stack = list(nodes)
+    while stack:
+        expr = stack.pop()
+        if isinstance(expr, TexNode):
+            expr = expr.expr
+        if isinstance(expr, TexExpr):
+            names.add(expr.name)
+            stack.extend(expr.all)
+    return names
+
+
 class LatexCommand(abc.ABC):
     priority = 0
 
@@ -64,10 +105,24 @@ class LatexCommand(abc.ABC):
     def apply(self, context: dict, node: TexNode, *args: str) -> apply_result | tuple[apply_result] | bool:
         pass
 
-    def invoke(self, context: dict, node: TexNode, *args: str) -> None:
+    # replaces the node with the result of apply, returns the change of the document length
+    def invoke(self, context: dict, node: TexNode, *args: str) -> int:
+        node_len = len(str(node))
+        # apply may mutate the node, so its contents are collected beforehand
+        changed_names = expression_names(node)
         replacement = self.apply(context, node, *args)
         if replacement is False:
-            return
+            return 0
+
+        if isinstance(replacement, tuple):
+            replacement_len = sum(len(str(r)) for r in replacement)
+            inserted = replacement
+        elif isinstance(replacement, str):
+            replacement_len = len(replacement)
+            inserted = tuple(TexSoup(replacement).expr.contents)
+        else:
+            replacement_len = len(str(replacement))
+            inserted = (replacement,)
 
         for arg in node.parent.args:
             if node in arg.children:
@@ -75,25 +130,17 @@ class LatexCommand(abc.ABC):
                 for c in arg.contents:
                     if c != node:
                         contents.append(c)
-                    elif isinstance(replacement, tuple):
-                        contents.extend(replacement)
-                    elif isinstance(replacement, str):
-                        soup = TexSoup(replacement)
-                        contents.extend(soup.expr.contents)
                     else:
-                        contents.append(replacement)
+                        contents.extend(inserted)
 
                 # we need to do this because TexSoup has a sanity check, but we're using a stronger syntax than LaTeX
                 arg._contents = [TexText(c) if isinstance(c, str) else c for c in contents]
                 break
         else:
-            if isinstance(replacement, tuple):
-                node.parent.replace(node, *replacement)
-            elif isinstance(replacement, str):
-                soup = TexSoup(replacement)
-                node.parent.replace(node, *soup.expr.contents)
-            else:
-                node.parent.replace(node, replacement)
+            node.parent.replace(node, *inserted)
+
+        context["changed_names"] |= changed_names | expression_names(*inserted)
+        return replacement_len - node_len
 
     def get_priority(self) -> int:
         return self.priority
@@ -245,6 +292,8 @@ class ProblemMacro(LatexCommand):
         self.newline_after = standalone
         self.newline_before = standalone or start
         self.inline = inline
+        # our teachers forget to use \zp instead of \ze. so, enjoy this little back-analysis to fix it
+        self.is_full_problem = "%(leth)s" not in fmt and conduit_include and problem == 1
 
     @staticmethod
     def update_iterator(context: dict, it_name: str, value: int):
@@ -260,21 +309,17 @@ class ProblemMacro(LatexCommand):
         self.update_iterator(context, "problem", self.problem)
         self.update_iterator(context, "letter", self.letter)
 
-        # our teachers forget to use \zp instead of \ze. so, enjoy this little back-analysis to fix it
-        is_full_problem = "%(leth)s" not in self.fmt and self.conduit_include and self.problem == 1
-        if context["added_full_problem"] and not is_full_problem and self.problem != 1:
+        if context["added_full_problem"] and not self.is_full_problem and self.problem != 1:
             raise ValueError(locale["exceptions"]["subproblem_issue"] % context["iterators"]["problem"])
-        context["added_full_problem"] = is_full_problem
+        context["added_full_problem"] = self.is_full_problem
 
         letter_ord = context.get("letter-order", "")
         if letter_ord:
             letter_str = letter_ord[context["iterators"]["letter"]]
         else:
-            letter_index = context["iterators"]["letter"] + sum(
-                1 for i in problem_skip_indices if i < context["iterators"]["letter"]
-            )
+            letter = context["iterators"]["letter"]
+            letter_index = letter + bisect_left(problem_skip_indices, letter)
             letter_str = chr(ord(first_problem_character) + letter_index)
-        format_data = {"z": context["iterators"]["problem"], "leth": letter_str}
 
         if not args:
             extra_text = ""
@@ -282,7 +327,7 @@ class ProblemMacro(LatexCommand):
             extra_text = f" ({args[0]})"
         else:
             extra_text = f" ({args[0].contents[0]})"  # type: ignore
-        format_data["ext"] = extra_text
+        format_data = {"z": context["iterators"]["problem"], "leth": letter_str, "ext": extra_text}
         fmt, cfmt = self.fmt % format_data, self.cfmt % format_data
         fmt = fmt.replace("))", ")")
         context["last_iterator"] = (cfmt or fmt).rstrip(").")
@@ -402,6 +447,17 @@ def soup_to_command(cmd: TexNode) -> tuple[str, LatexCommand]:
     )
 
 
+# finds the commands of all given priorities in a single walk over the soup, in document order
+def search_commands(
+    soup: TexNode, command_priorities: dict[str, int], priorities: set[int]
+) -> dict[int, list[TexNode]]:
+    found = {priority: [] for priority in priorities}
+    for node in soup.descendants:
+        if isinstance(node, TexNode) and command_priorities.get(node.name) in priorities:
+            found[command_priorities[node.name]].append(node)
+    return found
+
+
 def postprocess(soup: TexSoup, context: dict) -> tuple[TexSoup, dict]:
     for func in context["postprocess"].values():
         func(soup, context)
@@ -409,17 +465,20 @@ def postprocess(soup: TexSoup, context: dict) -> tuple[TexSoup, dict]:
 
 
 def convert_latex(context_commands: dict[str, LatexCommand], latext: str) -> tuple[TexSoup, dict]:
-    soup = TexSoup(latext)
-    command_adds = (
-        list(soup.find_all("newcommand"))
-        + list(soup.find_all("renewcommand"))
-        + list(soup.find_all("newcommand*"))
-        + list(soup.find_all("renewcommand*"))
-    )
+    soup = parse_latex(latext)
+    # definitions are registered kind by kind, so that e.g. \renewcommand wins over \newcommand wherever it is
+    definition_names = ["newcommand", "renewcommand", "newcommand*", "renewcommand*"]
+    command_adds = sorted(soup.find_all(definition_names), key=lambda c: definition_names.index(c.name))
     for new_command in command_adds:
         name, command = soup_to_command(new_command)
         context_commands[name] = command
-        new_command.parent.remove(new_command)
+
+    # TexNode.remove looks nodes up by string comparison, so they are filtered out by identity in one pass instead.
+    # definitions can also sit inside an argument of their parent, the same way invoke handles them
+    removed = {id(c.expr) for c in command_adds}
+    for parent in {id(c.parent.expr): c.parent.expr for c in command_adds}.values():
+        for group in (parent, *parent.args):
+            group._contents = [c for c in group._contents if id(c) not in removed]
     latext = str(soup)
 
     char_limit = cfg["compilation"]["character-limit"]
@@ -433,22 +492,30 @@ def convert_latex(context_commands: dict[str, LatexCommand], latext: str) -> tup
         "postprocess": {},
         "footnotes": [],
         "added_full_problem": False,
+        "changed_names": set(),
     }
-    length_check_distance = cfg["compilation"]["length-check-distance"]
+    length_resync_distance = cfg["compilation"]["length-resync-distance"]
     cmd_limit = cfg["compilation"]["max-command-count"]
-    before_next_check = 1
+
+    command_priorities = {name: c.get_priority() for name, c in context_commands.items()}
+    all_priorities = sorted(set(command_priorities.values()), reverse=True)
 
     for j in range(max_regens):
-        soup = TexSoup(latext)
-        all_priorities = sorted(set(c.get_priority() for c in context_commands.values()), reverse=True)
+        soup = parse_latex(latext)
+        # the length is tracked through the deltas reported by invoke, and only recounted once in a while
+        soup_len = len(latext)
+        before_resync = length_resync_distance
+        # search results stay valid until a command of the same priority is inserted into or removed from the soup
+        searched_cache = {}
         for i in range(nesting_limit):
             last_stage = priority_cap
             for priority in all_priorities:
-                command_keys = list(
-                    c for c in context_commands.keys() if context_commands[c].get_priority() == priority
-                )
+                if priority not in searched_cache:
+                    # every outdated priority is refreshed by the same walk
+                    outdated = {p for p in all_priorities if p not in searched_cache}
+                    searched_cache.update(search_commands(soup, command_priorities, outdated))
 
-                searched = soup.find_all(command_keys)
+                searched = searched_cache[priority]
                 if len(searched) > cmd_limit:
                     raise ValueError(
                         locale["exceptions"]["too_many_commands"] % dict(limit=cmd_limit, size=len(searched))
@@ -459,16 +526,21 @@ def convert_latex(context_commands: dict[str, LatexCommand], latext: str) -> tup
                         continue
 
                     arg_data = [" ".join(str(x) for x in arg.contents) if arg.contents else "" for arg in cmd.args]
-                    callback.invoke(context, cmd, *arg_data)
+                    soup_len += callback.invoke(context, cmd, *arg_data)
                     last_stage = priority
 
-                    before_next_check -= 1
-                    if not before_next_check:
+                    before_resync -= 1
+                    if soup_len > char_limit or not before_resync:
                         soup_len = len(str(soup))
                         if soup_len > char_limit:
                             raise ValueError(locale["exceptions"]["latex_big"] % dict(limit=char_limit, size=soup_len))
 
-                        before_next_check = random.randint(1, length_check_distance)
+                        before_resync = length_resync_distance
+
+                for name in context["changed_names"]:
+                    if name in command_priorities:
+                        searched_cache.pop(command_priorities[name], None)
+                context["changed_names"].clear()
                 if last_stage == priority:
                     break
             if last_stage == priority_cap:
@@ -1,8 +1,11 @@
+import asyncio
 import functools
-import json
+import time
 from datetime import datetime, timedelta
 
 import anyio
+import orjson
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
@@ -29,20 +32,34 @@ templates.env.globals["get_flashed_messages"] = get_flashed_messages
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 user_datastore = datastore_manager.get("accounts")
 locale = get_config("localization")
+webcfg = get_config("website")
+# decoded token payloads; a token is still rejected once its own expiry passes
+jwt_cache = TTLCache(maxsize=10000, ttl=60)
+# parsed accounts, anything that edits an account has to call invalidate_user afterwards;
+# edits made by other processes (setup.py create-admin / create-techops) only show up once the 5 s ttl expires
+user_cache = TTLCache(maxsize=1024, ttl=5)
 
 
 def find_user(username: str) -> None | User:
-    user_dict = user_datastore.accounts
-    if username not in user_dict:
-        return None
+    user_obj = user_cache.get(username)
+    if user_obj is None:
+        user_dict = user_datastore.accounts
+        if username not in user_dict:
+            return None
+
+        user_obj = User.parse_obj(deatomize(user_dict[username]))
+        user_cache[username] = user_obj
 
-    user_obj = User.parse_obj(deatomize(user_dict[username]))
     if not user_obj.privileges.login:
         raise HTTPException(status_code=401, detail=locale["exceptions"]["account_disabled"])
 
     return user_obj
 
 
+def invalidate_user(username: str) -> None:
+    user_cache.pop(username, None)
+
+
 def flash_message(request: Request, message: str, level: str = "info"):
     if not (flash_list := request.session.get("flash")):
         flash_list = []
@@ -51,9 +68,14 @@ def flash_message(request: Request, message: str, level: str = "info"):
 
 
 async def get_user_by_token(token: str) -> None | User:
-    try:
-        payload = jwt.decode(token, get_config("secrets")["jwt_salt"], algorithms=["HS256"])
-    except jwt.JWTError:
+    payload = jwt_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, get_config("secrets")["jwt_salt"], algorithms=["HS256"])
+        except jwt.JWTError:
+            return None
+        jwt_cache[token] = payload
+    elif "exp" in payload and payload["exp"] < time.time():
         return None
 
     subject: str = payload.get("sub")
@@ -116,8 +138,8 @@ async def make_template_data(request: Request, user: None | User = None, **kwarg
     return dict(
         kwargs,
         request=request,
-        locale=get_config("localization"),
-        webcfg=get_config("website"),
+        locale=locale,
+        webcfg=webcfg,
         user=user,
         check_scope=check_scope,
     )
@@ -143,27 +165,34 @@ class SocketHandle:
                     return text
 
     async def receive_json(self, period: float = None) -> dict:
-        return json.loads(await self.receive_text(period))
+        return orjson.loads(await self.receive_text(period))
 
 
 class SocketManager:
     def __init__(self):
-        self.active_connections: set[WebSocket] = set()
+        self.active_connections: list[WebSocket] = []
+        self.connection_indices: dict[WebSocket, int] = {}
         self.allocated = 0
 
     async def connect(self, websocket: WebSocket) -> SocketHandle:
         await websocket.accept()
-        self.active_connections.add(websocket)
+        self.connection_indices[websocket] = len(self.active_connections)
+        self.active_connections.append(websocket)
         self.allocated += 1
         return SocketHandle(self, websocket, self.allocated)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        # the last connection takes the place of the removed one, so that nothing has to be shifted
+        index = self.connection_indices.pop(websocket)
+        last = self.active_connections.pop()
+        if last is not websocket:
+            self.active_connections[index] = last
+            self.connection_indices[last] = index
 
     async def __broadcast(self, message: str, exclusions: set[WebSocket] = None):
-        for connection in self.active_connections:
-            if not exclusions or connection not in exclusions:
-                await connection.send_text(message)
+        targets = [c for c in self.active_connections if not exclusions or c not in exclusions]
+        # a failed send means the socket is closing, and its own handler will disconnect it
+        await asyncio.gather(*(c.send_text(message) for c in targets), return_exceptions=True)
 
     @functools.singledispatchmethod
     async def broadcast(self, message, exclusions: set[WebSocket] = None):
@@ -175,4 +204,6 @@ class SocketManager:
 
     @broadcast.register
     async def _(self, message: dict, exclusions: set[WebSocket] = None):
-        await self.__broadcast(json.dumps(message), exclusions)
+        # serialized once for all sockets; non-ascii text is sent as is instead of six-byte \u escapes.
+        # socket handle ids are used as keys in some messages, hence OPT_NON_STR_KEYS
+        await self.__broadcast(orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode(), exclusions)
@@ -7,7 +7,13 @@ from starlette.responses import HTMLResponse, PlainTextResponse
 from pyconduit.models.user import BulkRegister, Privileges, User, UserSensitive
 from pyconduit.shared.datastore import datastore_manager, deatomize
 from pyconduit.shared.helpers import get_config, partition, transform_to_login
-from pyconduit.website.decorators import RequireScope, get_current_user, make_template_data, templates
+from pyconduit.website.decorators import (
+    RequireScope,
+    get_current_user,
+    invalidate_user,
+    make_template_data,
+    templates,
+)
 from pyconduit.website.routers.login import default_hash
 
 admin_app = FastAPI(dependencies=[Depends(RequireScope("admin"))])
@@ -52,6 +58,7 @@ async def update_privileges(user_data: UserSensitive = Body(...)):
         old_data = dict(all_users.get(user_data.login, {}))
         old_data.update(user_data.dict())
         all_users[user_data.login] = old_data
+    invalidate_user(user_data.login)
     return {"success": True}
 
 
@@ -65,6 +72,7 @@ async def reset_password(login: str):
     with accounts.operation():
         accounts.accounts[login].password = password
         accounts.accounts[login].salt = salt
+    invalidate_user(login)
     return {"success": True, "password": new_password}
 
 
@@ -7,6 +7,7 @@ from pyconduit.shared.helpers import get_config
 from pyconduit.website.decorators import get_current_user, make_template_data, templates
 
 index_app = FastAPI()
+locale = get_config("localization")
 
 
 @index_app.get("/", response_class=HTMLResponse)
@@ -22,4 +23,4 @@ async def index_page(request: Request, user: None | User = Depends(get_current_u
 
 @index_app.get("/locale")
 async def get_locale():
-    return get_config("localization")
+    return locale
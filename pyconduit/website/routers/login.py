@@ -9,7 +9,14 @@ from starlette.responses import RedirectResponse, Response
 from pyconduit.models.user import ChangePasswordRequest, ConduitSettingsRequest, RegisterUser, User
 from pyconduit.shared.datastore import datastore_manager
 from pyconduit.shared.helpers import get_config
-from pyconduit.website.decorators import RequireScope, create_access_token, find_user, flash_message, require_login
+from pyconduit.website.decorators import (
+    RequireScope,
+    create_access_token,
+    find_user,
+    flash_message,
+    invalidate_user,
+    require_login,
+)
 
 login_app = FastAPI()
 secrets = get_config("secrets")
@@ -82,6 +89,7 @@ async def change_password(user: User = Depends(require_login), password: ChangeP
         user_acc = accounts.get(user.login, {})
         user_acc.password = new_password
         user_acc.salt = salt
+    invalidate_user(user.login)
     return {"message": locale["pages"]["index"]["password_changed"]}
 
 
@@ -98,6 +106,7 @@ async def conduit_settings(user: User = Depends(require_login), settings: Condui
             user_acc.allow_conduit_view = settings.allow_conduit_view
         if user.privileges.conduit_edit and settings.conduit_autosave is not None:
             user_acc.conduit_autosave = settings.conduit_autosave
+    invalidate_user(user.login)
     return {"message": locale["pages"]["index"]["conduit_settings_changed"]}
 
 